@@ -1,7 +1,11 @@
 import logging
 import os
-import time
-from selenium.common.exceptions import TimeoutException
+import json
+import re
+from datetime import date, datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
@@ -12,6 +16,13 @@ logger = logging.getLogger(__name__)
 
 class CheckInAutomation:
     """签到自动化主类"""
+    
+    HOME_URL = "https://www.natfrp.com/"
+    DASHBOARD_URL = "https://www.natfrp.com/user/"
+    CHECKIN_BUTTON_XPATH = "//button[.//span[contains(., '点击这里签到')]]"
+    CHECKED_IN_XPATH = "//p[contains(., '今天已经签到过啦')]"
+    AGE_CONFIRM_XPATH = "//div[@class='yes']/a[contains(text(), '是，我已满18岁')]"
+    
     def __init__(self, config: Config):
         self.config = config
         try:
@@ -30,29 +41,69 @@ class CheckInAutomation:
             from human_simulator import HumanSimulator  # 如果模块名不同
         self.simulator = HumanSimulator()
         self.max_retries = config.max_retries
+        safe_user = re.sub(r'[^\w.-]', '_', config.sakurafrp_user)
+        self.cookie_file = f"cookies_{safe_user}.json"
+        self.last_checkin_file = Path(f".last_checkin_{safe_user}")
     
-    def run(self):
-        """执行签到流程"""
+    def run(self, driver=None) -> bool:
+        """
+        执行签到流程
+        
+        Args:
+            driver: 可选，由调度方传入的共享 WebDriver；不传则复用进程内的共享实例
+        
+        Returns:
+            今日签到是否完成
+        """
+        # 今天已成功签到过则直接退出，不启动浏览器
+        if self._checked_in_today():
+            logger.info("今日已签到（本地记录），跳过")
+            logger.info("✓ 签到流程完成")
+            return True
+        
         # GitHub Actions 环境自动使用 headless 模式
         headless = os.getenv('CI') == 'true' or os.getenv('HEADLESS', 'false').lower() == 'true'
         
-        driver = self.driver_manager.initialize(headless=headless)
+        if driver is not None:
+            try:
+                self.driver_manager.reset_session(driver)
+            except Exception as e:  # 驱动进程已退出时抛出的是 urllib3 连接错误
+                logger.error(f"传入的 WebDriver 不可用，无法继续: {e}")
+                return False
+        else:
+            driver = self.driver_manager.get_driver(headless=headless)
         if not driver:
             logger.error("WebDriver 初始化失败，无法继续")
-            return
+            return False
+        
+        # 登录与跳转阶段不加载图片和字体
+        self.driver_manager.set_resource_blocking(driver, True)
         
         wait = WebDriverWait(driver, 20)
         
         try:
-            # 步骤1: 登录
-            if not self._login(driver, wait):
+            # 步骤0: 尝试用保存的 Cookie 恢复会话
+            session_state = self._restore_session(driver)
+            if session_state == "done":
+                logger.info("今日已签到")
+                self._mark_checked_in_today()
+                logger.info("✓ 签到流程完成")
+                return True
+            
+            # 步骤1: 登录（会话有效时跳过）
+            if session_state == "checkin":
+                logger.info("已通过保存的会话登录，跳过登录步骤")
+            elif not self._login(driver, wait):
                 logger.error("登录失败")
-                return
+                return False
             
             # 步骤2: 跳转到 处理年龄
             if not self._navigate_to_sakurafrp(driver, wait):
                 logger.error("跳转到 SakuraFrp 失败")
-                return
+                return False
+            
+            # 已登录并位于仪表板，保存 Cookie 供下次运行跳过登录
+            self._save_cookies(driver)
             
             # 步骤3: 执行签到
             if not self._perform_checkin(driver, wait):
@@ -60,25 +111,100 @@ class CheckInAutomation:
                 driver.save_screenshot('error_screenshot.png')
                 with open('error_page_source.html', 'w', encoding='utf-8') as f:
                     f.write(driver.page_source)
-                return
+                return False
             
+            self._save_cookies(driver)
             logger.info("✓ 签到流程完成")
+            return True
             
         except Exception as e:
             logger.error(f"执行过程中发生错误: {e}", exc_info=True)
+            return False
         finally:
             logger.info("脚本执行完毕，浏览器保持打开状态供检查")
     
+    def _restore_session(self, driver) -> str:
+        """
+        加载保存的 Cookie 并打开仪表板，判断会话状态
+        
+        返回值:
+            "checkin": 会话有效，尚未签到
+            "done": 会话有效，今日已签到
+            "login": 需要重新登录
+        """
+        if not os.path.exists(self.cookie_file):
+            return "login"
+        try:
+            with open(self.cookie_file, 'r', encoding='utf-8') as f:
+                cookies = json.load(f)
+            
+            # Cookie 只能添加到当前域名，先打开首页
+            driver.get(self.HOME_URL)
+            for cookie in cookies:
+                try:
+                    driver.add_cookie(cookie)
+                except Exception as e:
+                    logger.debug(f"添加 Cookie {cookie.get('name')} 失败: {e}")
+            driver.get(self.DASHBOARD_URL)
+            
+            # 登录框、签到按钮、已签到标识，先出现哪个就以哪个为准
+            element = WebDriverWait(driver, 10, poll_frequency=0.1).until(EC.any_of(
+                EC.presence_of_element_located((By.ID, 'username')),
+                EC.presence_of_element_located((By.XPATH, self.CHECKIN_BUTTON_XPATH)),
+                EC.presence_of_element_located((By.XPATH, self.CHECKED_IN_XPATH)),
+            ))
+        except TimeoutException:
+            logger.info("无法判断保存的会话状态，重新登录")
+            return "login"
+        except Exception as e:
+            logger.warning(f"恢复会话失败，重新登录: {e}")
+            return "login"
+        
+        if element.get_attribute('id') == 'username':
+            logger.info("保存的会话已失效，重新登录")
+            return "login"
+        return "checkin" if element.tag_name == 'button' else "done"
+    
+    @staticmethod
+    def _site_today() -> date:
+        """SakuraFrp 的签到日按北京时间划分，与主机时区无关"""
+        return datetime.now(ZoneInfo('Asia/Shanghai')).date()
+    
+    def _checked_in_today(self) -> bool:
+        """本地记录中是否今天已签到成功"""
+        try:
+            return self.last_checkin_file.read_text().strip() == self._site_today().isoformat()
+        except OSError:
+            return False
+    
+    def _mark_checked_in_today(self):
+        """记录今天已签到成功"""
+        try:
+            self.last_checkin_file.write_text(self._site_today().isoformat())
+        except OSError as e:
+            logger.warning(f"保存签到记录失败: {e}")
+    
+    def _save_cookies(self, driver):
+        """保存当前会话的 Cookie，供下次运行跳过登录"""
+        try:
+            cookies = driver.get_cookies()
+            if not cookies:
+                return
+            with open(self.cookie_file, 'w', encoding='utf-8') as f:
+                json.dump(cookies, f, ensure_ascii=False)
+        except Exception as e:
+            logger.warning(f"保存 Cookie 失败: {e}")
+    
     def _login(self, driver, wait: WebDriverWait) -> bool:
         """执行登录"""
-        login_url = "https://www.natfrp.com/user/"
-        logger.info(f"导航到登录页面: {login_url}")
-        driver.get(login_url)
+        logger.info(f"导航到登录页面: {self.DASHBOARD_URL}")
+        driver.get(self.DASHBOARD_URL)
         
         try:
-            # 输入用户名和密码
-            username_input = wait.until(EC.visibility_of_element_located((By.ID, 'username')))
-            password_input = wait.until(EC.visibility_of_element_located((By.ID, 'password')))
+            # 输入用户名和密码（两个输入框同时出现，合并为一次等待）
+            username_input, password_input = WebDriverWait(driver, 20, poll_frequency=0.1).until(
+                self._login_inputs_visible
+            )
             
             logger.info("输入登录凭据...")
             username_input.clear()
@@ -89,9 +215,12 @@ class CheckInAutomation:
             # 点击登录按钮
             login_button = wait.until(EC.element_to_be_clickable((By.ID, 'login')))
             logger.info("点击登录按钮...")
+            # 此时已被重定向到登录表单页，记录点击前的实际地址
+            form_url = driver.current_url
             driver.execute_script("arguments[0].click();", login_button)
             
-            self.simulator.random_sleep(3, 5)
+            # 等待离开登录表单页
+            WebDriverWait(driver, 20, poll_frequency=0.1).until(EC.url_changes(form_url))
             logger.info("登录成功")
             return True
             
@@ -102,6 +231,16 @@ class CheckInAutomation:
             logger.error(f"登录过程出错: {e}", exc_info=True)
             return False
     
+    @staticmethod
+    def _login_inputs_visible(driver):
+        """WebDriverWait 条件：用户名和密码输入框均可见时返回二者"""
+        try:
+            inputs = (driver.find_element(By.ID, 'username'), driver.find_element(By.ID, 'password'))
+            return inputs if all(element.is_displayed() for element in inputs) else False
+        except (NoSuchElementException, StaleElementReferenceException):
+            # 重定向过程中元素可能已被替换，下一轮重新查找
+            return False
+    
     def _navigate_to_sakurafrp(self, driver, wait: WebDriverWait) -> bool:
         """跳转到 SakuraFrp 仪表板"""
         try:
@@ -115,16 +254,19 @@ class CheckInAutomation:
             # sakura_link.click()
             # self.simulator.random_sleep(2, 4)
             
-            # 处理年龄确认弹窗（如果存在）
+            # 处理年龄确认弹窗（如果存在）；仪表板内容先出现则说明没有弹窗，不必等满超时
             try:
-                age_confirm = WebDriverWait(driver, 5).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, "//div[@class='yes']/a[contains(text(), '是，我已满18岁')]")
-                    )
-                )
-                logger.info("处理年龄确认弹窗...")
-                age_confirm.click()
-                self.simulator.random_sleep(2, 3)
+                element = WebDriverWait(driver, 5, poll_frequency=0.1).until(EC.any_of(
+                    EC.element_to_be_clickable((By.XPATH, self.AGE_CONFIRM_XPATH)),
+                    EC.presence_of_element_located((By.XPATH, self.CHECKIN_BUTTON_XPATH)),
+                    EC.presence_of_element_located((By.XPATH, self.CHECKED_IN_XPATH)),
+                ))
+                if element.tag_name == 'a':
+                    logger.info("处理年龄确认弹窗...")
+                    element.click()
+                    WebDriverWait(driver, 5, poll_frequency=0.1).until(EC.invisibility_of_element(element))
+                else:
+                    logger.info("未检测到年龄确认弹窗")
             except TimeoutException:
                 logger.info("未检测到年龄确认弹窗")
             
@@ -144,42 +286,31 @@ class CheckInAutomation:
         for attempt in range(1, self.max_retries+1):
             logger.info(f"验证码尝试 {attempt}/{self.max_retries}")
             try:
-                # 查找签到按钮
-                check_in_button = None
+                # 签到按钮或已签到标识，先出现哪个就以哪个为准
                 try:
-                    check_in_button = wait.until(
-                        EC.element_to_be_clickable(
-                            (By.XPATH, "//button[.//span[contains(., '点击这里签到')]]")
-                        )
-                    )
-                    logger.info("找到签到按钮")
+                    element = WebDriverWait(driver, 20, poll_frequency=0.1).until(EC.any_of(
+                        EC.element_to_be_clickable((By.XPATH, self.CHECKIN_BUTTON_XPATH)),
+                        EC.visibility_of_element_located((By.XPATH, self.CHECKED_IN_XPATH)),
+                    ))
                 except TimeoutException:
-                    # 检查是否已签到
-                    try:
-                        WebDriverWait(driver, 2).until(
-                            EC.visibility_of_element_located(
-                                (By.XPATH, "//p[contains(., '今天已经签到过啦')]")
-                            )
-                        )
-                        logger.info("今日已签到")
-                        return True
-                    except TimeoutException:
-                        logger.error("未找到签到按钮或已签到标识")
-                        return False
+                    logger.error("未找到签到按钮或已签到标识")
+                    return False
+                
+                if element.tag_name != 'button':
+                    logger.info("今日已签到")
+                    self._mark_checked_in_today()
+                    return True
                 
                 # 点击签到按钮
-                if check_in_button:
-                    logger.info("点击签到按钮...")
-                    driver.execute_script("arguments[0].click();", check_in_button)
-                    self.simulator.random_sleep(2, 4)
-                    
-                    # 处理验证码
-                    captcha_result = self.captcha_handler.handle_geetest_captcha(driver, wait)
-                    driver.refresh()
-                    time.sleep(5)
-                    continue
-
-                return False
+                logger.info("找到签到按钮")
+                # 验证码依赖图片资源，点击前恢复加载
+                self.driver_manager.set_resource_blocking(driver, False)
+                logger.info("点击签到按钮...")
+                driver.execute_script("arguments[0].click();", element)
+                
+                # 处理验证码（内部会等待验证码窗口出现）
+                captcha_result = self.captcha_handler.handle_geetest_captcha(driver, wait)
+                driver.refresh()
                 
             except Exception as e:
                 logger.error(f"签到过程出错: {e}", exc_info=True)
@@ -0,0 +1,70 @@
+import logging
+import json
+import sqlite3
+import time
+from io import BytesIO
+from typing import Optional, Dict
+
+import imagehash
+from PIL import Image
+
+# 优先使用 orjson 解析 JSON（可直接接受 bytes），未安装时回退到标准库
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaCache:
+    """验证码识别结果缓存（以图片感知哈希为键，持久化到 SQLite）"""
+
+    def __init__(self, db_path: str = 'captcha_cache.db', ttl: int = 7 * 24 * 3600):
+        self.ttl = ttl
+        # 识别在后台线程中进行，连接需允许跨线程使用
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS captcha_cache "
+            "(phash TEXT PRIMARY KEY, json TEXT, ts INT)"
+        )
+        self._evict_expired()
+
+    @staticmethod
+    def phash(img_bytes: bytes) -> str:
+        """计算图片的感知哈希"""
+        return str(imagehash.phash(Image.open(BytesIO(img_bytes))))
+
+    def get(self, key: str) -> Optional[Dict]:
+        """查询缓存，过期或不存在时返回 None"""
+        row = self.conn.execute(
+            "SELECT json, ts FROM captcha_cache WHERE phash = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.conn.execute("DELETE FROM captcha_cache WHERE phash = ?", (key,))
+            self.conn.commit()
+            return None
+        return json_loads(row[0])
+
+    def set(self, key: str, result: Dict):
+        """写入识别结果"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO captcha_cache (phash, json, ts) VALUES (?, ?, ?)",
+            (key, json.dumps(result, ensure_ascii=False), int(time.time()))
+        )
+        self.conn.commit()
+
+    def delete(self, key: str):
+        """删除识别结果"""
+        self.conn.execute("DELETE FROM captcha_cache WHERE phash = ?", (key,))
+        self.conn.commit()
+
+    def _evict_expired(self):
+        """清理过期缓存"""
+        self.conn.execute(
+            "DELETE FROM captcha_cache WHERE ts < ?", (int(time.time()) - self.ttl,)
+        )
+        self.conn.commit()
@@ -1,17 +1,28 @@
 import logging
 import os
 import time
-import random
+import base64
 import json
 import re
-from typing import Optional, Dict
+import sqlite3
+import functools
+from io import BytesIO
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
 
-from selenium.common.exceptions import TimeoutException
+import requests
+from PIL import Image
+
+from selenium.common.exceptions import (
+    NoSuchElementException, StaleElementReferenceException, TimeoutException, WebDriverException
+)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 from openai import OpenAI
 from config import Config
+from captcha_cache import CaptchaCache, json_loads
 
 logger = logging.getLogger(__name__)
 
@@ -19,12 +30,64 @@ logger = logging.getLogger(__name__)
 class CaptchaHandler:
     """验证码处理器"""
     
+    # 点击 arguments[1]（预取的九宫格元素）中 arguments[0] 指定索引的格子
+    _CLICK_ITEMS_JS = """
+        var items = arguments[1];
+        for (var i of arguments[0]) items[i].click();
+    """
+    
+    # 在页面内每 100ms 检查一次确认按钮，可用时点击；超过 arguments[0] 毫秒仍未激活则强制点击
+    # 回调状态: 'clicked' 已点击, 'forced' 未激活但已强制点击, 'missing' 未找到按钮
+    _CLICK_COMMIT_JS = """
+        var timeout = arguments[0], callback = arguments[arguments.length - 1], start = Date.now();
+        (function check() {
+            var button = document.getElementsByClassName('geetest_commit')[0];
+            if (button && button.className.indexOf('geetest_disable') === -1) {
+                button.click();
+                callback('clicked');
+            } else if (Date.now() - start > timeout) {
+                if (button) button.click();
+                callback(button ? 'forced' : 'missing');
+            } else {
+                setTimeout(check, 100);
+            }
+        })();
+    """
+    
+    # 在页面内 fetch 图片并以 data URL 形式回调，请求失败或状态码异常时回调 null
+    _FETCH_IMAGE_JS = """
+        var callback = arguments[arguments.length - 1];
+        fetch(arguments[0]).then(r => {
+            if (!r.ok) throw new Error(r.status);
+            return r.blob();
+        }).then(blob => {
+            var reader = new FileReader();
+            reader.onloadend = () => callback(reader.result);
+            reader.readAsDataURL(blob);
+        }).catch(() => callback(null));
+    """
+    
+    # 发送给视觉模型的图片最大尺寸与 JPEG 质量
+    # detail=low 时 token 数固定，这里只为减小上传体积，尺寸保留到足以看清九宫格的每个格子
+    _MODEL_IMAGE_SIZE = (512, 512)
+    _MODEL_IMAGE_QUALITY = 80
+    
     def __init__(self, config: Config):
         self.config = config
         self.client = OpenAI(
             base_url=config.base_url,
             api_key=config.api_key
         )
+        # 缓存只是优化，数据库不可用（被锁、目录只读等）时不启用
+        try:
+            self.cache = CaptchaCache()
+        except sqlite3.Error as e:
+            logger.warning(f"验证码缓存不可用，本次不使用缓存: {e}")
+            self.cache = None
+        # WebDriver 不是线程安全的，识别线程与主线程访问 driver 时需加锁
+        self._driver_lock = threading.Lock()
+        # 进程内按图片 URL 缓存（driver 在进程内共享，实际键为 URL），命中时连图片下载都可省去
+        self._recognize_cached = functools.lru_cache(maxsize=32)(self._recognize_uncached)
 
     def get_img(self, wait: WebDriverWait):
         try:
@@ -58,76 +121,164 @@ class CaptchaHandler:
             img_url = self.get_img(wait)
             if not img_url:
                 logger.error("图片获取失败，刷新网页重试...")
-                time.sleep(2)
                 return False
             
-            # 调用视觉模型识别
-            recognition_result = self._recognize_captcha(img_url)
+            # 在后台线程调用视觉模型识别，同时在主线程预取九宫格元素
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(self._recognize_captcha, driver, img_url)
+                with self._driver_lock:
+                    grid_items = driver.find_elements(By.CLASS_NAME, "geetest_item")[:9]
+                recognition_result, cache_key = future.result()
             if not recognition_result:
                 logger.warning("识别失败，刷新网页重试...")
-                time.sleep(2)
                 return False
             
             logger.info(f"验证码识别结果: {recognition_result}")
             
+            # 清除之前的请求记录，只监听点击后产生的验证请求
+            del driver.requests
+            
             # 根据识别结果点击相应的九宫格
-            if not self._click_captcha_items(driver, recognition_result):
+            click_status = self._click_captcha_items(driver, recognition_result, grid_items)
+            if click_status != "clicked":
                 logger.warning("点击失败，刷新网页重试...")
-                time.sleep(2)
+                # 只有识别结果本身不可用时才清除缓存，页面元素问题不影响已验证的结果
+                if click_status == "unusable":
+                    self._discard_recognition(cache_key)
                 return False
             
+            # 等待验证请求返回，避免过早刷新页面；只缓存验证通过的识别结果
+            verification = self._wait_for_verification_result(driver)
+            if verification == "success":
+                self._store_recognition(cache_key, recognition_result)
+            elif verification == "fail":
+                self._discard_recognition(cache_key)
             logger.warning("验证码流程完成，刷新网页验证是否成功...")
-            time.sleep(2)
             return True
         except Exception as e:
             logger.error(f"处理验证码时发生错误: {e}", exc_info=True)
             return False
 
     
-    def _recognize_captcha(self, img_url: str) -> Optional[Dict]:
-        """使用视觉模型识别验证码"""
+    def _recognize_captcha(self, driver, img_url: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """识别验证码（优先查缓存），返回 (识别结果, 缓存键)，失败时识别结果为 None"""
         try:
-            prompt = (
-                '这是一个九宫格验证码，请按从左到右、从上到下的顺序识别每个格子里的物品名称，'
-                '最后识别左下角的参考图。输出格式为JSON：{"1":"名称", "2":"名称", ..., "10":"参考图名称"}。'
-                '名称要简洁，参考图名称必须是九宫格里已有的名称。若有类似物品（如气球与热气球），请统一名称。'
-                '只输出纯 JSON，不要使用 markdown 代码块，不要添加任何解释文字。'
-            )
-            
-            response = self.client.chat.completions.create(
-                model=self.config.model,
-                messages=[{
-                    'role': 'user',
-                    'content': [
-                        {'type': 'text', 'text': prompt},
-                        {'type': 'image_url', 'image_url': {'url': img_url}}
-                    ]
-                }],
-                stream=False
-            )
-            
-            result_content = response.choices[0].message.content
-            logger.info(f"模型原始输出: {result_content}")
-            
-            # 清理并解析 JSON
-            cleaned_str = result_content.replace("'", '"')
-            # 尝试提取 JSON 内容（处理可能包含其他文本的情况）
-            json_match = json.loads(cleaned_str) if cleaned_str.startswith('{') else None
-            
-            if not json_match:
-                logger.error("无法从模型输出中提取有效 JSON")
-                return None
-            
-            return json_match
-            
+            return self._recognize_cached(driver, img_url)
         except json.JSONDecodeError as e:
             logger.error(f"JSON 解析失败: {e}")
-            return None
+        except ValueError as e:
+            logger.error(str(e))
         except Exception as e:
             logger.error(f"验证码识别失败: {e}", exc_info=True)
+        return None, None
+
+    def _store_recognition(self, key: Optional[str], result: Dict):
+        """验证通过后写入持久化缓存"""
+        if not key or self.cache is None:
+            return
+        try:
+            self.cache.set(key, result)
+        except Exception as e:
+            logger.warning(f"写入验证码缓存失败: {e}")
+
+    def _discard_recognition(self, key: Optional[str]):
+        """识别结果未通过验证，清除对应的缓存，下次重新调用模型"""
+        self._recognize_cached.cache_clear()
+        if not key or self.cache is None:
+            return
+        try:
+            self.cache.delete(key)
+        except Exception as e:
+            logger.warning(f"删除验证码缓存失败: {e}")
+
+    def _recognize_uncached(self, driver, img_url: str) -> Tuple[Dict, Optional[str]]:
+        """按图片感知哈希查询持久化缓存，未命中时调用视觉模型；返回 (识别结果, 缓存键)"""
+        key = None
+        # 优先内联图片数据，避免模型服务端再次下载
+        model_image = img_url
+        data_url = self._fetch_image(driver, img_url)
+        if data_url:
+            img_bytes = base64.b64decode(data_url.partition(',')[2])
+            if self.cache is not None:
+                try:
+                    key = self.cache.phash(img_bytes)
+                    cached = self.cache.get(key)
+                    if cached:
+                        logger.info(f"命中验证码缓存: {key}")
+                        return cached, key
+                except Exception as e:
+                    logger.warning(f"验证码缓存查询失败，直接调用模型: {e}")
+            
+            try:
+                model_image = self._downscale_image(img_bytes)
+            except Exception as e:
+                logger.warning(f"压缩验证码图片失败，使用原图: {e}")
+                model_image = data_url
+
+        return self._query_model(model_image), key
+
+    def _downscale_image(self, img_bytes: bytes) -> str:
+        """将验证码图片缩小并转为 JPEG data URL，减少上传体积和视觉 token"""
+        image = Image.open(BytesIO(img_bytes)).convert('RGB')
+        # 保持宽高比，且只缩小不放大
+        image.thumbnail(self._MODEL_IMAGE_SIZE, Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=self._MODEL_IMAGE_QUALITY)
+        return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    def _fetch_image(self, driver, img_url: str) -> Optional[str]:
+        """在浏览器会话中下载验证码图片并转为 data URL，失败时回退到 requests"""
+        try:
+            # 该方法在识别线程中执行，与主线程的 driver 调用互斥
+            with self._driver_lock:
+                data_url = driver.execute_async_script(self._FETCH_IMAGE_JS, img_url)
+            if data_url:
+                return data_url
+        except WebDriverException as e:
+            logger.warning(f"浏览器内下载验证码图片失败: {e}")
+        
+        try:
+            response = requests.get(img_url, timeout=10)
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', 'image/png')
+            return f"data:{content_type};base64,{base64.b64encode(response.content).decode()}"
+        except requests.RequestException as e:
+            logger.warning(f"下载验证码图片失败: {e}")
             return None
+
+    def _query_model(self, img_url: str) -> Dict:
+        """使用视觉模型识别验证码"""
+        prompt = (
+            '这是一个九宫格验证码，请按从左到右、从上到下的顺序识别每个格子里的物品名称，'
+            '最后识别左下角的参考图。输出格式为JSON：{"1":"名称", "2":"名称", ..., "10":"参考图名称"}。'
+            '名称要简洁，参考图名称必须是九宫格里已有的名称。若有类似物品（如气球与热气球），请统一名称。'
+            '只输出纯 JSON，不要使用 markdown 代码块，不要添加任何解释文字。'
+        )
+        
+        response = self.client.chat.completions.create(
+            model=self.config.model,
+            messages=[{
+                'role': 'user',
+                'content': [
+                    {'type': 'text', 'text': prompt},
+                    {'type': 'image_url', 'image_url': {'url': img_url, 'detail': 'low'}}
+                ]
+            }],
+            stream=False
+        )
+        
+        result_content = response.choices[0].message.content
+        logger.debug(f"模型原始输出: {result_content}")
+        
+        # 尝试提取 JSON 内容（处理可能包含其他文本的情况）
+        json_match = json_loads(result_content) if result_content.startswith('{') else None
+        
+        if not json_match:
+            raise ValueError("无法从模型输出中提取有效 JSON")
+        
+        return json_match
     
-    def _click_captcha_items(self, driver, recognition_result: Dict) -> bool:
+    def _click_captcha_items(self, driver, recognition_result: Dict, grid_items: List) -> str:
         """
         根据识别结果点击九宫格中匹配的格子
         
@@ -137,99 +288,81 @@ class CaptchaHandler:
         7  8  9
         
         第10个是参考图（左下角）
+        
+        返回值:
+            "clicked": 已点击
+            "unusable": 识别结果不可用（缺少参考图名称或没有匹配的格子）
+            "error": 页面元素问题导致点击失败
         """
         try:
             # 获取参考图名称（第10个元素）
             target_name = recognition_result.get("10", "").strip()
             if not target_name:
                 logger.error("未能从识别结果中获取参考图名称")
-                return False
+                return "unusable"
             
             logger.info(f"目标物品: {target_name}")
             
-            # 获取所有九宫格元素（前9个）
-            grid_items = driver.find_elements(By.CLASS_NAME, "geetest_item")
-            
-            # 排除最后一个（参考图），只处理前9个
-            if len(grid_items) < 9:
-                logger.error(f"九宫格元素数量不足，只找到 {len(grid_items)} 个")
-                return False
-            
-            clickable_items = grid_items[:9]
-            
-            # 遍历前9个格子，找到匹配的物品并点击
-            clicked_count = 0
+            # 遍历前9个格子，收集与参考图匹配的位置
+            hits = []
             for i in range(9):
                 position = i + 1  # 位置索引从1开始
                 item_name = recognition_result.get(str(position), "").strip()
                 
-                logger.info(f"位置 {position}: {item_name}")
+                logger.debug(f"位置 {position}: {item_name}")
                 
                 # 如果当前格子的物品名称匹配参考图
                 if item_name and item_name == target_name:
-                    logger.info(f"找到匹配项！位置 {position} - {item_name}")
-                    
-                    # 点击该格子
-                    try:
-                        # 使用 JavaScript 点击，更稳定
-                        driver.execute_script("arguments[0].click();", clickable_items[i])
-                        clicked_count += 1
-                        logger.info(f"已点击位置 {position}")
-                        
-                        # 点击后短暂等待，模拟人类操作
-                        time.sleep(random.uniform(0.3, 0.6))
-                        
-                    except Exception as e:
-                        logger.error(f"点击位置 {position} 时出错: {e}")
+                    logger.debug(f"找到匹配项！位置 {position} - {item_name}")
+                    hits.append(i)
             
-            if clicked_count == 0:
+            if not hits:
                 logger.warning(f"未找到匹配 '{target_name}' 的格子")
-                return False
+                return "unusable"
             
-            logger.info(f"共点击了 {clicked_count} 个匹配的格子")
-            
-            # 点击完成后，查找并点击确认按钮
+            # 一次 JS 调用点击全部匹配的格子；预取的元素在识别期间可能失效，失效时重新查找一次
             try:
-                # 等待确认按钮变为可用状态（移除 geetest_disable 类）
-                confirm_button = WebDriverWait(driver, 5).until(
-                    EC.presence_of_element_located((By.CLASS_NAME, "geetest_commit"))
-                )
-                
-                # 检查按钮是否可用（没有 geetest_disable 类）
-                button_classes = confirm_button.get_attribute("class")
-                logger.info(f"确认按钮状态: {button_classes}")
-                
-                # 等待按钮变为可点击状态（最多等待3秒）
-                max_wait = 3
-                start = time.time()
-                while "geetest_disable" in confirm_button.get_attribute("class"):
-                    if time.time() - start > max_wait:
-                        logger.warning("确认按钮未激活，但仍尝试点击")
-                        break
-                    time.sleep(0.2)
-                    confirm_button = driver.find_element(By.CLASS_NAME, "geetest_commit")
-                
-                logger.info("找到确认按钮，准备点击...")
-                driver.execute_script("arguments[0].click();", confirm_button)
+                self._click_grid(driver, hits, grid_items)
+            except StaleElementReferenceException:
+                logger.info("九宫格元素已失效，重新查找后点击")
+                self._click_grid(driver, hits, driver.find_elements(By.CLASS_NAME, "geetest_item")[:9])
+            
+            logger.info(f"共点击了 {len(hits)} 个匹配的格子: {[i + 1 for i in hits]}")
+            
+            # 点击完成后，等待确认按钮可用（移除 geetest_disable 类）并点击
+            commit_status = driver.execute_async_script(self._CLICK_COMMIT_JS, 3000)
+            if commit_status == 'clicked':
                 logger.info("已点击确认按钮")
-                time.sleep(1)
-            except TimeoutException:
+            elif commit_status == 'forced':
+                logger.warning("确认按钮未激活，但仍尝试点击")
+            else:
                 logger.info("未找到确认按钮，可能自动提交")
             
-            return True
+            return "clicked"
             
         except Exception as e:
             logger.error(f"点击验证码格子时发生错误: {e}", exc_info=True)
-            return False
+            return "error"
+    
+    def _click_grid(self, driver, hits: List[int], grid_items: List):
+        """点击九宫格中指定索引的格子，格子不足9个时抛出异常"""
+        # 排除最后一个（参考图），只处理前9个
+        if len(grid_items) < 9:
+            raise ValueError(f"九宫格元素数量不足，只找到 {len(grid_items)} 个")
+        driver.execute_script(self._CLICK_ITEMS_JS, hits, grid_items)
     
     def _refresh_captcha(self, driver) -> bool:
         """刷新验证码"""
         try:
             logger.info("正在刷新验证码...")
+            old_src = driver.find_element(By.CLASS_NAME, "geetest_item_img").get_attribute("src")
             refresh_button = driver.find_element(By.CLASS_NAME, "geetest_refresh")
             driver.execute_script("arguments[0].click();", refresh_button)
             logger.info("已点击刷新按钮")
-            time.sleep(1.5)  # 等待新验证码加载
+            # 等待新验证码图片加载
+            WebDriverWait(driver, 5, poll_frequency=0.1).until(
+                lambda d: d.find_element(By.CLASS_NAME, "geetest_item_img").get_attribute("src") != old_src
+            )
             return True
         except Exception as e:
             logger.error(f"刷新验证码失败: {e}")
@@ -239,64 +372,78 @@ class CaptchaHandler:
         """
         等待并检测验证结果（通过监听网络请求）
         
+        调用前需先执行 del driver.requests，只保留点击后产生的请求
+        
         返回值:
             "success": 验证成功
             "fail": 验证失败
             "closed": 验证码窗口已关闭
             "timeout": 超时
         """
+        logger.info("监听验证结果...")
+        deadline = time.time() + timeout
+        # 捕获范围已限定为验证接口，每 100ms 只检查新增且已有响应的记录
+        seen = 0
         try:
-            logger.info("监听验证结果...")
-            start_time = time.time()
-            
-            # 清除之前的请求记录，只监听新的请求
-            del driver.requests
-            
-            while time.time() - start_time < timeout:
-                # 检查网络请求
-                for request in driver.requests:
-                    if request.response and 'api.geevisit.com/ajax.php' in request.url:
-                        try:
-                            # 获取响应内容
-                            response_body = request.response.body.decode('utf-8')
-                            logger.info(f"捕获到验证API响应: {response_body[:200]}")
-                            
-                            # 解析 JSONP 响应：geetest_xxx({"status": "success", ...})
-                            json_match = re.search(r'geetest_\d+\((.*)\)', response_body)
-                            if json_match:
-                                json_str = json_match.group(1)
-                                result_data = json.loads(json_str)
-                                
-                                status = result_data.get('status')
-                                if status == 'success':
-                                    data = result_data.get('data', {})
-                                    result = data.get('result', '')
-                                    
-                                    if result == 'success':
-                                        logger.info("✓ API返回验证成功")
-                                        return "success"
-                                    elif result == 'fail':
-                                        logger.warning("✗ API返回验证失败")
-                                        return "fail"
-                            
-                        except Exception as e:
-                            logger.debug(f"解析响应时出错: {e}")
-                
-                # 同时检查验证码窗口是否关闭
-                try:
-                    widget = driver.find_element(By.CLASS_NAME, "geetest_widget")
-                    if not widget.is_displayed():
-                        logger.info("验证码窗口已关闭")
-                        return "closed"
-                except:
-                    logger.info("验证码窗口未找到")
-                    return "closed"
-                
-                time.sleep(0.5)
-            
-            logger.warning(f"验证结果等待超时 ({timeout}秒)")
-            return "timeout"
-            
+            while True:
+                captured = driver.requests
+                for request in captured[seen:]:
+                    if not request.response:
+                        break
+                    seen += 1
+                    result = self._parse_verification_response(request)
+                    if result:
+                        return result
+                if time.time() >= deadline:
+                    break
+                time.sleep(0.1)
         except Exception as e:
             logger.error(f"等待验证结果时出错: {e}", exc_info=True)
             return "timeout"
+        
+        # 未拿到验证结果，检查一次验证码窗口是否已关闭
+        if self._captcha_closed(driver):
+            return "closed"
+        logger.warning(f"验证结果等待超时 ({timeout}秒)")
+        return "timeout"
+
+    def _parse_verification_response(self, request) -> Optional[str]:
+        """解析验证 API 的 JSONP 响应，返回 "success"/"fail"，无结果时返回 None"""
+        try:
+            # 直接在原始字节上切分和解析，不做解码
+            response_body = request.response.body
+            logger.info(f"捕获到验证API响应: {response_body[:200].decode('utf-8', 'replace')}")
+            
+            # JSONP 响应固定为 geetest_xxx({"status": "success", ...})，按首尾括号切出 JSON
+            if response_body.startswith(b'geetest_'):
+                json_str = response_body.partition(b'(')[2].rpartition(b')')[0]
+                result_data = json_loads(json_str)
+                
+                status = result_data.get('status')
+                if status == 'success':
+                    data = result_data.get('data', {})
+                    result = data.get('result', '')
+                    
+                    if result == 'success':
+                        logger.info("✓ API返回验证成功")
+                        return "success"
+                    elif result == 'fail':
+                        logger.warning("✗ API返回验证失败")
+                        return "fail"
+        
+        except Exception as e:
+            logger.debug(f"解析响应时出错: {e}")
+        return None
+
+    @staticmethod
+    def _captcha_closed(driver) -> bool:
+        """检查验证码窗口是否已关闭"""
+        try:
+            widget = driver.find_element(By.CLASS_NAME, "geetest_widget")
+            if not widget.is_displayed():
+                logger.info("验证码窗口已关闭")
+                return True
+        except NoSuchElementException:
+            logger.info("验证码窗口未找到")
+            return True
+        return False
@@ -1,6 +1,7 @@
 import logging
+import logging.handlers
 import os
-from typing import Optional
+from typing import Optional, List
 from dataclasses import dataclass
 
 # 尝试加载 .env 文件
@@ -10,18 +11,38 @@ try:
 except ImportError:
     pass
 
-# 配置日志
+# 配置日志（文件日志先缓冲在内存中，满 200 条或遇到 ERROR 时再写盘，退出时自动刷新）
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_file_handler = logging.FileHandler('checkin.log', encoding='utf-8', delay=True)
+_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('checkin.log', encoding='utf-8')
+        logging.handlers.MemoryHandler(capacity=200, flushLevel=logging.ERROR, target=_file_handler)
     ]
 )
 logger = logging.getLogger(__name__)
 
 
+def flush_logs():
+    """将缓冲中的日志写入文件（进程池子进程以 os._exit 退出，不会触发 logging.shutdown）"""
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+def discard_buffered_logs():
+    """丢弃内存中尚未写盘的日志，fork 出的子进程用它清掉从父进程继承的缓冲"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.MemoryHandler):
+            handler.acquire()
+            try:
+                handler.buffer.clear()
+            finally:
+                handler.release()
+
+
 @dataclass
 class Config:
     """配置数据类"""
@@ -34,8 +55,8 @@ class Config:
     max_retries: int = 10
     
     @classmethod
-    def from_env(cls) -> 'Config':
-        """从环境变量加载配置"""
+    def from_env(cls, suffix: str = "") -> 'Config':
+        """从环境变量加载配置，suffix 为账户编号后缀（如 "_1"）"""
         def get_env(key: str, required: bool = True) -> str:
             value = os.environ.get(key, "").split('\n')[0].strip()
             if required and not value:
@@ -43,11 +64,21 @@ class Config:
             return value
         
         return cls(
-            sakurafrp_user=get_env("SAKURAFRP_USER"),
-            sakurafrp_pass=get_env("SAKURAFRP_PASS"),
+            sakurafrp_user=get_env(f"SAKURAFRP_USER{suffix}"),
+            sakurafrp_pass=get_env(f"SAKURAFRP_PASS{suffix}"),
             base_url=get_env("BASE_URL"),
             api_key=get_env("API_KEY"),
             model=get_env("MODEL"),
             chrome_binary_path=get_env("CHROME_BINARY_PATH", required=False),
             max_retries=int(get_env("MAX_RETRIES", required=False) or 10)
-        )
\ No newline at end of file
+        )
+    
+    @classmethod
+    def list_from_env(cls) -> List['Config']:
+        """加载多账户配置（SAKURAFRP_USER_1/SAKURAFRP_PASS_1、_2 ...），未设置编号账户时回退到单账户"""
+        configs = []
+        index = 1
+        while os.environ.get(f"SAKURAFRP_USER_{index}", "").strip():
+            configs.append(cls.from_env(f"_{index}"))
+            index += 1
+        return configs or [cls.from_env()]
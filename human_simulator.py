@@ -6,8 +6,11 @@ class HumanSimulator:
     """模拟人类行为"""
     
     @staticmethod
-    def type_text(element, text: str, min_delay: float = 0.05, max_delay: float = 0.2):
-        """模拟人类打字"""
+    def type_text(element, text: str, min_delay: float = 0.05, max_delay: float = 0.2, fast: bool = True):
+        """模拟人类打字（fast=True 时一次性输入整段文本）"""
+        if fast:
+            element.send_keys(text)
+            return
         for char in text:
             element.send_keys(char)
             time.sleep(random.uniform(min_delay, max_delay))
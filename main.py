@@ -1,20 +1,60 @@
-from config import Config
+import os
+from concurrent.futures import ProcessPoolExecutor
+from config import Config, flush_logs, discard_buffered_logs
 from automation import CheckInAutomation
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def run_checkin(config: Config) -> bool:
+    """执行单个账户的签到（可在子进程中运行），返回是否成功"""
+    try:
+        logger.info(f"使用账户: {config.sakurafrp_user}")
+        return CheckInAutomation(config).run()
+    finally:
+        flush_logs()
+
+
+def log_summary(results: dict):
+    """
+    记录每个账户的签到结果和汇总行，send_email.py 依据汇总行判断整体是否成功
+    
+    Args:
+        results: 账户名 -> 是否签到成功
+    """
+    for user, success in results.items():
+        logger.info(f"账户 {user} 签到结果: {'成功' if success else '失败'}")
+    succeeded = sum(1 for success in results.values() if success)
+    logger.info(f"签到汇总: 成功 {succeeded}/{len(results)}")
+
+
 def main():
     """主函数"""
     try:
         # 加载配置
-        config = Config.from_env()
-        logger.info(f"使用账户: {config.sakurafrp_user}")
+        configs = Config.list_from_env()
         
         # 执行自动签到
-        automation = CheckInAutomation(config)
-        automation.run()
+        if len(configs) == 1:
+            log_summary({configs[0].sakurafrp_user: run_checkin(configs[0])})
+            return
+        
+        # 多账户并行签到，每个进程使用独立的浏览器
+        max_workers = min(len(configs), os.cpu_count() or 1)
+        logger.info(f"共 {len(configs)} 个账户，并行进程数: {max_workers}")
+        # 创建子进程前先写盘，子进程中再清空继承的缓冲，避免日志重复
+        flush_logs()
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=discard_buffered_logs) as executor:
+            futures = [executor.submit(run_checkin, config) for config in configs]
+            results = {}
+            for config, future in zip(configs, futures):
+                try:
+                    results[config.sakurafrp_user] = bool(future.result())
+                except Exception as e:
+                    logger.error(f"账户 {config.sakurafrp_user} 签到失败: {e}", exc_info=True)
+                    results[config.sakurafrp_user] = False
+        log_summary(results)
         
     except ValueError as e:
         logger.error(f"配置错误: {e}")
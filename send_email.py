@@ -1,11 +1,67 @@
 import smtplib
 import os
+import io
+import gzip
+import re
+import shutil
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+from email.mime.application import MIMEApplication
 from datetime import datetime
 
+# 正文只读取日志末尾的字节数
+LOG_TAIL_BYTES = 4096
+# 附件超过该大小时先 gzip 压缩
+GZIP_THRESHOLD = 64 * 1024
+# main.py 输出的汇总行：签到汇总: 成功 <成功数>/<账户数>
+SUMMARY_RE = re.compile(r'签到汇总: 成功 (\d+)/(\d+)')
+
+# 进程内复用的 SMTP 连接及其对应的 (服务器, 端口, 账户)
+_smtp_conn = None
+_smtp_key = None
+
+
+def get_conn(smtp_server, smtp_port, sender_email, sender_password):
+    """
+    获取已完成 STARTTLS 和登录的 SMTP 连接，连接失效时重新建立
+    
+    Args:
+        smtp_server: SMTP 服务器地址
+        smtp_port: SMTP 端口
+        sender_email: 发件账户
+        sender_password: 发件账户密码
+    """
+    global _smtp_conn, _smtp_key
+    key = (smtp_server, smtp_port, sender_email)
+    if _smtp_conn is not None and _smtp_key == key:
+        try:
+            _smtp_conn.noop()
+            return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+    close_conn()
+    
+    conn = smtplib.SMTP(smtp_server, smtp_port)
+    try:
+        conn.starttls()
+        conn.login(sender_email, sender_password)
+    except Exception:
+        conn.close()
+        raise
+    _smtp_conn, _smtp_key = conn, key
+    return conn
+
+
+def close_conn():
+    """关闭复用的 SMTP 连接"""
+    global _smtp_conn, _smtp_key
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.quit()
+        except (smtplib.SMTPException, OSError):
+            _smtp_conn.close()
+    _smtp_conn = _smtp_key = None
+
 
 def send_log_email(log_file='checkin.log'):
     """
@@ -27,16 +83,19 @@ def send_log_email(log_file='checkin.log'):
         return False
     
     try:
-        # 读取日志内容
+        # 只读取日志末尾，避免日志过大时整体载入内存
         log_content = ""
         if os.path.exists(log_file):
-            with open(log_file, 'r', encoding='utf-8') as f:
-                log_content = f.read()
+            log_size = os.path.getsize(log_file)
+            with open(log_file, 'rb') as f:
+                f.seek(max(0, log_size - LOG_TAIL_BYTES))
+                log_content = f.read().decode('utf-8', 'replace')
         else:
             log_content = "日志文件不存在"
         
-        # 判断签到是否成功（根据日志内容）
-        is_success = "签到流程完成" in log_content or "验证码验证成功" in log_content
+        # 判断签到是否成功：以 main.py 最后写入的汇总行为准，所有账户都成功才算成功
+        summaries = SUMMARY_RE.findall(log_content)
+        is_success = bool(summaries) and summaries[-1][0] == summaries[-1][1]
         status_emoji = "✅" if is_success else "❌"
         status_text = "成功" if is_success else "失败"
         
@@ -65,20 +124,30 @@ SakuraFrp 自动签到报告
         
         msg.attach(MIMEText(body, 'plain', 'utf-8'))
         
-        # 添加日志附件
+        # 添加日志附件（较大时 gzip 压缩）
         if os.path.exists(log_file):
+            filename = os.path.basename(log_file)
             with open(log_file, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(log_file)}')
+                if log_size > GZIP_THRESHOLD:
+                    buffer = io.BytesIO()
+                    with gzip.GzipFile(filename=filename, mode='wb', fileobj=buffer) as gz:
+                        shutil.copyfileobj(f, gz)
+                    payload = buffer.getvalue()
+                    filename += '.gz'
+                else:
+                    payload = f.read()
+            part = MIMEApplication(payload, Name=filename)
+            part.add_header('Content-Disposition', 'attachment', filename=filename)
             msg.attach(part)
         
-        # 发送邮件
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
+        # 发送邮件（get_conn 在 NOOP 检测失败时已自动重连）
+        # send_message 开始后不再重试：服务器可能已接收邮件再断开，重试会导致重复发送
+        conn = get_conn(smtp_server, smtp_port, sender_email, sender_password)
+        try:
+            conn.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            close_conn()
+            raise
         
         print(f"✅ 邮件发送成功: {receiver_email}")
         return True
@@ -89,4 +158,5 @@ SakuraFrp 自动签到报告
 
 
 if __name__ == "__main__":
-    send_log_email()
\ No newline at end of file
+    send_log_email()
+    close_conn()
\ No newline at end of file
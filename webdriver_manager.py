@@ -3,8 +3,10 @@ import os
 import time
 import random
 from typing import Optional
+from urllib.parse import urlsplit
 
 from seleniumwire import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -17,10 +19,68 @@ logger = logging.getLogger(__name__)
 class WebDriverManager:
     """WebDriver 管理器"""
     
+    # 进程内共享的浏览器实例，多次签到复用同一个 Chrome
+    _shared_driver = None
+    
+    # 复用浏览器时需要清理站点存储的来源
+    SESSION_ORIGINS = ['https://www.natfrp.com']
+    
+    # 登录和仪表板页面不需要加载的图片与字体资源
+    BLOCKED_RESOURCE_PATTERNS = [
+        '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.ico',
+        '*.woff', '*.woff2', '*.ttf',
+    ]
+    
     def __init__(self, config):
         self.config = config
         self.driver = None
     
+    def get_driver(self, headless: bool = False):
+        """获取共享的 WebDriver，已存在时清理会话后复用，否则重新初始化"""
+        driver = WebDriverManager._shared_driver
+        if driver is not None:
+            try:
+                self.reset_session(driver)
+                logger.info("复用已有的 WebDriver 实例")
+                self.driver = driver
+                return driver
+            except Exception as e:  # 驱动进程已退出时抛出的是 urllib3 连接错误
+                logger.warning(f"已有 WebDriver 不可用，重新初始化: {e}")
+                WebDriverManager._shared_driver = None
+        
+        driver = self.initialize(headless=headless)
+        WebDriverManager._shared_driver = driver
+        return driver
+    
+    @staticmethod
+    def reset_session(driver):
+        """清理所有域名的 Cookie、站点存储与已捕获的请求，使下一次签到从干净的会话开始"""
+        # delete_all_cookies 只作用于当前页面的域名，这里通过 CDP 清除浏览器内全部 Cookie
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        
+        # 清理当前页面及 SakuraFrp 站点的本地存储
+        origins = set(WebDriverManager.SESSION_ORIGINS)
+        current_origin = urlsplit(driver.current_url)
+        if current_origin.scheme in ('http', 'https'):
+            origins.add(f"{current_origin.scheme}://{current_origin.netloc}")
+        for origin in origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                "origin": origin,
+                "storageTypes": "all",
+            })
+        del driver.requests
+    
+    def set_resource_blocking(self, driver, enabled: bool):
+        """通过 CDP 屏蔽/恢复图片与字体加载，验证码出现前需要关闭屏蔽"""
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {
+                "urls": self.BLOCKED_RESOURCE_PATTERNS if enabled else []
+            })
+            logger.info(f"{'已屏蔽' if enabled else '已恢复'}图片与字体资源加载")
+        except WebDriverException as e:
+            logger.warning(f"设置资源屏蔽失败: {e}")
+    
     def initialize(self, headless: bool = False):
         """初始化 Selenium-Wire WebDriver"""
         logger.info("正在初始化 Selenium-Wire WebDriver...")
@@ -28,7 +88,9 @@ class WebDriverManager:
         # 配置 selenium-wire 以捕获请求
         wire_options = {
             'disable_capture': False,  # 启用请求捕获
-            'disable_encoding': True,   # 禁用内容编码以便读取响应
+            'disable_encoding': True,   # 禁用内容编码以便读取 GeeTest 验证响应
+            'request_storage': 'memory',  # 请求记录只保存在内存中
+            'request_storage_max_size': 50,
         }
         
         ops = Options()
@@ -40,6 +102,10 @@ class WebDriverManager:
         ops.add_argument('--disable-gpu')
         ops.add_argument('--no-sandbox')
         ops.add_argument('--disable-dev-shm-usage')  # 解决 Docker/CI 环境内存问题
+        ops.add_argument('--disable-extensions')
+        ops.add_argument('--disable-background-networking')
+        ops.add_argument('--disable-sync')
+        ops.add_argument('--mute-audio')
 
         ops.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
         
@@ -82,6 +148,8 @@ class WebDriverManager:
                 )
             
             if self.driver:
+                # 只捕获 GeeTest 验证接口，其余请求直接放行不做记录
+                self.driver.scopes = [r'.*api\.geevisit\.com/ajax\.php.*']
                 self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
                     "source": """
                         Object.defineProperty(navigator, 'webdriver', {
@@ -101,4 +169,7 @@ class WebDriverManager:
         """关闭 WebDriver"""
         if self.driver:
             self.driver.quit()
-            logger.info("WebDriver 已关闭")
\ No newline at end of file
+            if WebDriverManager._shared_driver is self.driver:
+                WebDriverManager._shared_driver = None
+            self.driver = None
+            logger.info("WebDriver 已关闭")